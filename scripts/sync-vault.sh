@@ -53,13 +53,19 @@ for pf in "${priority_files[@]}"; do
   fi
 done
 
+# Running size of the context file in bytes - each note is measured once,
+# so the limit check doesn't re-measure the growing output file
+current_size=$(wc -c < "$CONTEXT_FILE" 2>/dev/null || echo 0)
+
+# Byte semantics for ${#header} below (it counts characters in a UTF-8 locale)
+LC_ALL=C
+
 # Then PARA folders (Areas most important, then Projects, then Resources)
 for folder in Areas Projects Resources; do
   if [ ! -d "$folder" ]; then continue; fi
 
   while IFS= read -r -d '' file; do
     # Skip if we've hit size limit (500KB)
-    current_size=$(wc -c < "$CONTEXT_FILE" 2>/dev/null || echo 0)
     if [ "$current_size" -gt 500000 ]; then
       echo "  Size limit reached at $file_count files"
       break 2
@@ -67,10 +73,15 @@ for folder in Areas Projects Resources; do
 
     # Get relative path
     relpath="${file#./}"
-
-    echo "=== $relpath ===" >> "$CONTEXT_FILE"
-    cat "$file" >> "$CONTEXT_FILE"
-    echo -e "\n" >> "$CONTEXT_FILE"
+    header="=== $relpath ==="
+    size=$(wc -c < "$file")
+
+    {
+      echo "$header"
+      cat "$file"
+      echo -e "\n"
+    } >> "$CONTEXT_FILE"
+    current_size=$((current_size + ${#header} + 1 + size + 2))
     ((file_count++)) || true
 
   done < <(find "./$folder" -maxdepth "$VAULT_DEPTH" -name "*.md" -type f -print0 2>/dev/null)
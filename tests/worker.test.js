@@ -6,22 +6,206 @@
  */
 
 // Import the sanitizeQuery function logic (copy for testing since we can't import ESM easily)
+const INJECTION_PATTERN = new RegExp(
+  [
+    '(?:ignore|disregard|forget) (?:all )?(?:previous |above |prior )?instructions',
+    'you are now',
+    'new instructions:',
+    'system prompt:',
+  ].join('|'),
+  'gi'
+);
+
 function sanitizeQuery(query) {
-  const dangerous = [
-    /ignore (all )?(previous |above |prior )?instructions/gi,
-    /disregard (all )?(previous |above |prior )?instructions/gi,
-    /forget (all )?(previous |above |prior )?instructions/gi,
-    /you are now/gi,
-    /new instructions:/gi,
-    /system prompt:/gi,
-  ];
+  const sanitized = query.replace(INJECTION_PATTERN, '[removed]');
+  return sanitized.slice(0, 1000);
+}
+
+// Copy of isDuplicateUpdate (same reason as above)
+const seenUpdates = new Map();
+const DEDUP_WINDOW_MS = 10 * 60 * 1000;
+const DEDUP_MAX_ENTRIES = 10000;
+
+function isDuplicateUpdate(updateId, now = Date.now()) {
+  if (updateId === undefined) return false;
 
-  let sanitized = query;
-  for (const pattern of dangerous) {
-    sanitized = sanitized.replace(pattern, '[removed]');
+  for (const [id, seenAt] of seenUpdates) {
+    if (now - seenAt <= DEDUP_WINDOW_MS) break;
+    seenUpdates.delete(id);
   }
 
-  return sanitized.slice(0, 1000);
+  if (seenUpdates.has(updateId)) return true;
+
+  seenUpdates.set(updateId, now);
+  if (seenUpdates.size > DEDUP_MAX_ENTRIES) {
+    seenUpdates.delete(seenUpdates.keys().next().value);
+  }
+  return false;
+}
+
+// Copy of normalizeQuery (same reason as above)
+const TRAILING_PUNCTUATION = /[?.!]+$/;
+const WHITESPACE_RUN = /\s+/g;
+
+function normalizeQuery(query) {
+  return query
+    .toLowerCase()
+    .trim()
+    .replace(TRAILING_PUNCTUATION, '')
+    .replace(WHITESPACE_RUN, ' ');
+}
+
+// Copy of the /ask answer cache and in-flight coalescing (same reason as above).
+// queryGemini is a stub each test replaces.
+const ASK_TIMEOUT_MS = 25000;
+let queryGemini = async () => 'stub';
+
+const answerCache = new Map();
+const ANSWER_CACHE_TTL_MS = 10 * 60 * 1000;
+const ANSWER_CACHE_MAX_ENTRIES = 200;
+let answerCacheEtag = null;
+
+function resetAnswerCacheOnVaultChange(etag) {
+  if (etag !== answerCacheEtag) {
+    answerCache.clear();
+    answerCacheEtag = etag;
+  }
+}
+
+function getCachedAnswer(etag, key, now = Date.now()) {
+  resetAnswerCacheOnVaultChange(etag);
+  const hit = answerCache.get(key);
+  if (!hit) return null;
+  answerCache.delete(key);
+  if (now - hit.cachedAt > ANSWER_CACHE_TTL_MS) return null;
+
+  answerCache.set(key, hit);
+  return hit.answer;
+}
+
+function pruneExpiredAnswers(now = Date.now()) {
+  const before = answerCache.size;
+  for (const [key, entry] of answerCache) {
+    if (now - entry.cachedAt > ANSWER_CACHE_TTL_MS) {
+      answerCache.delete(key);
+    }
+  }
+  return before - answerCache.size;
+}
+
+function cacheAnswer(etag, key, answer, now = Date.now()) {
+  if (etag !== answerCacheEtag) return;
+
+  answerCache.delete(key);
+  answerCache.set(key, { answer, cachedAt: now });
+
+  if (answerCache.size > ANSWER_CACHE_MAX_ENTRIES && pruneExpiredAnswers(now) === 0) {
+    answerCache.delete(answerCache.keys().next().value);
+  }
+}
+
+const inflightAnswers = new Map();
+const FLIGHT_ABANDONED = Symbol('flight abandoned');
+
+async function waitForFlight(flight) {
+  let timerId;
+  const abandoned = new Promise(resolve => {
+    timerId = setTimeout(() => resolve(FLIGHT_ABANDONED), Math.max(0, flight.deadline - Date.now()));
+  });
+  try {
+    return await Promise.race([flight.promise, abandoned]);
+  } finally {
+    clearTimeout(timerId);
+  }
+}
+
+async function answerQuery(env, vaultContent, etag, query, now = Date.now()) {
+  const key = normalizeQuery(query);
+  const hit = getCachedAnswer(etag, key, now);
+  if (hit) {
+    return { answer: hit, cached: true };
+  }
+
+  const flightKey = `${etag}:${key}`;
+  const joined = inflightAnswers.get(flightKey);
+  if (joined) {
+    const answer = await waitForFlight(joined);
+    if (answer !== FLIGHT_ABANDONED) {
+      return { answer, cached: false };
+    }
+  }
+
+  const flight = { deadline: now + ASK_TIMEOUT_MS };
+  flight.promise = queryGemini(env, vaultContent, query)
+    .then(answer => {
+      cacheAnswer(etag, key, answer, now);
+      return answer;
+    })
+    .finally(() => {
+      if (inflightAnswers.get(flightKey) === flight) {
+        inflightAnswers.delete(flightKey);
+      }
+    });
+  inflightAnswers.set(flightKey, flight);
+
+  return { answer: await flight.promise, cached: false };
+}
+
+// Copy of truncateAnswer (same reason as above)
+const MAX_ANSWER_CHARS = 3900;
+
+function truncateAnswer(answer) {
+  if (answer.length <= MAX_ANSWER_CHARS) return answer;
+
+  let cut = answer.lastIndexOf('\n\n', MAX_ANSWER_CHARS);
+  if (cut < MAX_ANSWER_CHARS / 2) cut = answer.lastIndexOf('\n', MAX_ANSWER_CHARS);
+  if (cut < MAX_ANSWER_CHARS / 2) cut = MAX_ANSWER_CHARS;
+
+  const last = answer.charCodeAt(cut - 1);
+  if (last >= 0xd800 && last <= 0xdbff) cut--;
+
+  return `${answer.slice(0, cut).trimEnd()}\n\n_[Truncated]_`;
+}
+
+// Copy of buildGeminiBody and its prompt pieces (same reason as above)
+const PROMPT_PREAMBLE = `You are a helpful assistant with access to a personal knowledge vault.
+
+Here is the vault content:
+
+`;
+
+const PROMPT_INSTRUCTIONS = `Be concise and specific. If you can't find relevant information in the vault, say so.
+Cite which files you found the information in when relevant.`;
+
+const GENERATION_CONFIG_JSON = JSON.stringify({
+  maxOutputTokens: 1024,
+  temperature: 0.7,
+});
+
+let encodedPrefix = { vaultContent: null, json: null };
+
+function encodedPromptPrefix(vaultContent) {
+  if (encodedPrefix.vaultContent !== vaultContent) {
+    encodedPrefix = {
+      vaultContent,
+      json: JSON.stringify(PROMPT_PREAMBLE + vaultContent).slice(0, -1),
+    };
+  }
+  return encodedPrefix.json;
+}
+
+function buildGeminiBody(vaultContent, sanitizedQuery) {
+  const questionPart = `
+
+---
+
+Based on the vault content above, answer this question:
+${sanitizedQuery}
+
+${PROMPT_INSTRUCTIONS}`;
+  const promptJson = encodedPromptPrefix(vaultContent) + JSON.stringify(questionPart).slice(1);
+
+  return `{"contents":[{"parts":[{"text":${promptJson}}]}],"generationConfig":${GENERATION_CONFIG_JSON}}`;
 }
 
 // Simple test framework
@@ -40,6 +224,18 @@ function test(name, fn) {
   }
 }
 
+async function testAsync(name, fn) {
+  try {
+    await fn();
+    console.log(`  ✓ ${name}`);
+    passed++;
+  } catch (e) {
+    console.log(`  ✗ ${name}`);
+    console.log(`    ${e.message}`);
+    failed++;
+  }
+}
+
 function assertEqual(actual, expected, msg = '') {
   if (actual !== expected) {
     throw new Error(`Expected "${expected}" but got "${actual}" ${msg}`);
@@ -128,10 +324,324 @@ test('handles multiple injection attempts', () => {
   assertNotIncludes(result, 'you are now');
 });
 
-// Summary
-console.log('\n=== Results ===\n');
-console.log(`  Passed: ${passed}`);
-console.log(`  Failed: ${failed}`);
-console.log('');
+test('removes every occurrence of a phrase', () => {
+  const result = sanitizeQuery('you are now x, you are now y');
+  assertNotIncludes(result, 'you are now');
+});
+
+test('handles repeated calls with the shared global regex', () => {
+  const input = 'system prompt: one';
+  assertEqual(sanitizeQuery(input), sanitizeQuery(input));
+});
+
+console.log('\n=== isDuplicateUpdate Tests ===\n');
+
+test('first delivery is not a duplicate', () => {
+  seenUpdates.clear();
+  assertEqual(isDuplicateUpdate(1, 0), false);
+});
+
+test('redelivery within window is a duplicate', () => {
+  seenUpdates.clear();
+  isDuplicateUpdate(1, 0);
+  assertEqual(isDuplicateUpdate(1, 1000), true);
+});
+
+test('redelivery after window is not a duplicate', () => {
+  seenUpdates.clear();
+  isDuplicateUpdate(1, 0);
+  assertEqual(isDuplicateUpdate(1, DEDUP_WINDOW_MS + 1), false);
+});
+
+test('expired entries are evicted', () => {
+  seenUpdates.clear();
+  isDuplicateUpdate(1, 0);
+  isDuplicateUpdate(2, 1000);
+  isDuplicateUpdate(3, DEDUP_WINDOW_MS + 500);
+  assertEqual(seenUpdates.has(1), false);
+  assertEqual(seenUpdates.has(2), true);
+});
+
+test('store is capped at max entries', () => {
+  seenUpdates.clear();
+  for (let i = 0; i <= DEDUP_MAX_ENTRIES; i++) {
+    isDuplicateUpdate(i, 0);
+  }
+  assertEqual(seenUpdates.size, DEDUP_MAX_ENTRIES);
+  assertEqual(seenUpdates.has(0), false);
+});
+
+test('missing update_id is never a duplicate', () => {
+  seenUpdates.clear();
+  assertEqual(isDuplicateUpdate(undefined, 0), false);
+  assertEqual(isDuplicateUpdate(undefined, 0), false);
+});
+
+console.log('\n=== normalizeQuery Tests ===\n');
+
+test('lowercases and trims', () => {
+  assertEqual(normalizeQuery('  What Are My Priorities  '), 'what are my priorities');
+});
+
+test('strips trailing punctuation', () => {
+  assertEqual(normalizeQuery('what are my priorities?!'), 'what are my priorities');
+});
+
+test('collapses internal whitespace', () => {
+  assertEqual(normalizeQuery('what   are\tmy\npriorities'), 'what are my priorities');
+});
+
+test('keeps punctuation inside the query', () => {
+  assertEqual(normalizeQuery('RAG vs. embeddings?'), 'rag vs. embeddings');
+});
+
+test('variants share one key', () => {
+  assertEqual(normalizeQuery('What are my priorities?'), normalizeQuery('what are my priorities'));
+});
+
+console.log('\n=== answer cache Tests ===\n');
+
+function resetAnswerCache(etag = 'etag1') {
+  answerCache.clear();
+  answerCacheEtag = null;
+  getCachedAnswer(etag, '', 0);
+}
+
+test('returns a cached answer within the TTL', () => {
+  resetAnswerCache();
+  cacheAnswer('etag1', 'q', 'answer', 0);
+  assertEqual(getCachedAnswer('etag1', 'q', ANSWER_CACHE_TTL_MS), 'answer');
+});
+
+test('expired answers miss and are removed', () => {
+  resetAnswerCache();
+  cacheAnswer('etag1', 'q', 'answer', 0);
+  assertEqual(getCachedAnswer('etag1', 'q', ANSWER_CACHE_TTL_MS + 1), null);
+  assertEqual(answerCache.has('q'), false);
+});
+
+test('a hit refreshes LRU position', () => {
+  resetAnswerCache();
+  for (let i = 0; i < ANSWER_CACHE_MAX_ENTRIES; i++) {
+    cacheAnswer('etag1', `q${i}`, `a${i}`, 0);
+  }
+  getCachedAnswer('etag1', 'q0', 0);
+  cacheAnswer('etag1', 'new', 'a', 0);
+  assertEqual(answerCache.has('q0'), true);
+  assertEqual(answerCache.has('q1'), false);
+});
+
+test('expired entries are swept before a live LRU entry is evicted', () => {
+  resetAnswerCache();
+  const later = ANSWER_CACHE_TTL_MS;
+  cacheAnswer('etag1', 'live-lru', 'a', later);
+  cacheAnswer('etag1', 'old', 'a', 0);
+  for (let i = 0; i < ANSWER_CACHE_MAX_ENTRIES - 2; i++) {
+    cacheAnswer('etag1', `q${i}`, 'a', later);
+  }
+  cacheAnswer('etag1', 'new', 'a', later + 1);
+  assertEqual(answerCache.has('old'), false);
+  assertEqual(answerCache.has('live-lru'), true);
+  assertEqual(answerCache.has('new'), true);
+});
+
+test('capacity is never exceeded', () => {
+  resetAnswerCache();
+  for (let i = 0; i < ANSWER_CACHE_MAX_ENTRIES * 3; i++) {
+    cacheAnswer('etag1', `q${i}`, 'a', i);
+    if (answerCache.size > ANSWER_CACHE_MAX_ENTRIES) {
+      throw new Error(`size ${answerCache.size} after insert ${i}`);
+    }
+  }
+  assertEqual(answerCache.size, ANSWER_CACHE_MAX_ENTRIES);
+});
+
+test('a lookup under a new vault etag empties the cache', () => {
+  resetAnswerCache();
+  cacheAnswer('etag1', 'q', 'answer', 0);
+  assertEqual(getCachedAnswer('etag2', 'q', 0), null);
+  assertEqual(answerCache.size, 0);
+  assertEqual(answerCacheEtag, 'etag2');
+});
+
+test('an answer for a superseded etag is dropped without resetting', () => {
+  resetAnswerCache();
+  getCachedAnswer('etag2', 'q', 0);
+  cacheAnswer('etag2', 'current', 'new answer', 0);
+  cacheAnswer('etag1', 'q', 'stale answer', 0);
+  assertEqual(answerCacheEtag, 'etag2');
+  assertEqual(answerCache.has('q'), false);
+  assertEqual(getCachedAnswer('etag2', 'current', 0), 'new answer');
+});
+
+console.log('\n=== buildGeminiBody Tests ===\n');
+
+function expectedGeminiBody(vaultContent, sanitizedQuery) {
+  const text = `${PROMPT_PREAMBLE}${vaultContent}
+
+---
+
+Based on the vault content above, answer this question:
+${sanitizedQuery}
+
+${PROMPT_INSTRUCTIONS}`;
+  return JSON.stringify({
+    contents: [{ parts: [{ text }] }],
+    generationConfig: { maxOutputTokens: 1024, temperature: 0.7 },
+  });
+}
+
+const spliceCases = [
+  ['plain text', '## File: a.md\nnotes', 'what did I note?'],
+  ['quotes at the boundary', 'he said "hi"', '"quoted" question'],
+  ['backslashes at the boundary', 'C:\\path\\', '\\escaped\\'],
+  ['control characters', 'tab\there\r\n\u0000\u001f\b\f', '\u0007bell\u007f'],
+  ['line and paragraph separators', 'end\u2028\u2029', '\u2028q'],
+  ['surrogate pair at the end of the vault', 'emoji 😀', '😀 first'],
+  ['lone high surrogate at the end of the vault', 'broken \ud83d', 'q'],
+  ['lone low surrogate at the start of the query', 'v', '\ude00 broken'],
+  ['empty vault and query', '', ''],
+];
+
+for (const [name, vault, query] of spliceCases) {
+  test(`spliced body matches JSON.stringify: ${name}`, () => {
+    const body = buildGeminiBody(vault, query);
+    assertEqual(body, expectedGeminiBody(vault, query));
+    assertEqual(JSON.parse(body).contents[0].parts[0].text.startsWith(PROMPT_PREAMBLE + vault), true);
+  });
+}
+
+test('reuses the encoded prefix across queries on the same vault', () => {
+  const vault = 'same "vault"\n';
+  buildGeminiBody(vault, 'first');
+  const cached = encodedPrefix;
+  assertEqual(buildGeminiBody(vault, 'second'), expectedGeminiBody(vault, 'second'));
+  assertEqual(encodedPrefix, cached);
+});
+
+test('re-encodes the prefix when the vault changes', () => {
+  buildGeminiBody('old vault', 'q');
+  assertEqual(buildGeminiBody('new vault', 'q'), expectedGeminiBody('new vault', 'q'));
+});
+
+console.log('\n=== truncateAnswer Tests ===\n');
+
+test('leaves short answers untouched', () => {
+  assertEqual(truncateAnswer('short *answer*'), 'short *answer*');
+});
+
+test('cuts at the last paragraph break before the limit', () => {
+  const answer = 'a'.repeat(3000) + '\n\n*bold ' + 'b'.repeat(2000) + '*';
+  assertEqual(truncateAnswer(answer), 'a'.repeat(3000) + '\n\n_[Truncated]_');
+});
+
+test('falls back to a line break when there is no paragraph break', () => {
+  const answer = 'a'.repeat(3000) + '\n' + 'b'.repeat(2000);
+  assertEqual(truncateAnswer(answer), 'a'.repeat(3000) + '\n\n_[Truncated]_');
+});
+
+test('never splits a surrogate pair', () => {
+  const answer = 'a'.repeat(MAX_ANSWER_CHARS - 1) + '😀'.repeat(100);
+  const result = truncateAnswer(answer);
+  assertEqual(result, 'a'.repeat(MAX_ANSWER_CHARS - 1) + '\n\n_[Truncated]_');
+});
+
+test('stays under the Telegram limit with the footer', () => {
+  const result = truncateAnswer('x'.repeat(10000));
+  assertEqual(result.length <= MAX_ANSWER_CHARS + 20, true);
+});
+
+// Async tests run after the sync ones, then the summary
+(async () => {
+  console.log('\n=== answerQuery Tests ===\n');
+
+  function resetAnswerState() {
+    answerCache.clear();
+    answerCacheEtag = null;
+    inflightAnswers.clear();
+  }
+
+  await testAsync('concurrent identical queries share one Gemini call', async () => {
+    resetAnswerState();
+    let calls = 0;
+    queryGemini = async () => {
+      calls++;
+      await new Promise(resolve => setTimeout(resolve, 10));
+      return 'shared answer';
+    };
+    const [a, b] = await Promise.all([
+      answerQuery({}, 'vault', 'etag1', 'What is X?'),
+      answerQuery({}, 'vault', 'etag1', 'what is x'),
+    ]);
+    assertEqual(calls, 1);
+    assertEqual(a.answer, 'shared answer');
+    assertEqual(b.answer, 'shared answer');
+  });
+
+  await testAsync('flight is removed once it settles', async () => {
+    resetAnswerState();
+    queryGemini = async () => 'answer';
+    await answerQuery({}, 'vault', 'etag1', 'q');
+    assertEqual(inflightAnswers.size, 0);
+  });
+
+  await testAsync('failed flight rejects every caller and is removed', async () => {
+    resetAnswerState();
+    let calls = 0;
+    queryGemini = async () => {
+      calls++;
+      await new Promise(resolve => setTimeout(resolve, 10));
+      throw new Error('Gemini API error: boom');
+    };
+    const results = await Promise.allSettled([
+      answerQuery({}, 'vault', 'etag1', 'q'),
+      answerQuery({}, 'vault', 'etag1', 'q'),
+    ]);
+    assertEqual(calls, 1);
+    assertEqual(results[0].status, 'rejected');
+    assertEqual(results[1].status, 'rejected');
+    assertEqual(inflightAnswers.size, 0);
+
+    queryGemini = async () => 'retried';
+    assertEqual((await answerQuery({}, 'vault', 'etag1', 'q')).answer, 'retried');
+  });
+
+  await testAsync('joiner makes its own call once the leader is past its deadline', async () => {
+    resetAnswerState();
+    let calls = 0;
+    queryGemini = () => {
+      calls++;
+      // First call hangs, as a fetch cancelled with its request would
+      return calls === 1 ? new Promise(() => {}) : Promise.resolve('own answer');
+    };
+    answerQuery({}, 'vault', 'etag1', 'q', Date.now() - ASK_TIMEOUT_MS);
+    const { answer } = await answerQuery({}, 'vault', 'etag1', 'q');
+    assertEqual(calls, 2);
+    assertEqual(answer, 'own answer');
+    assertEqual(inflightAnswers.size, 0);
+  });
+
+  await testAsync('different vault versions do not share a flight', async () => {
+    resetAnswerState();
+    let calls = 0;
+    queryGemini = async (env, vault) => {
+      calls++;
+      return `answer from ${vault}`;
+    };
+    const [a, b] = await Promise.all([
+      answerQuery({}, 'old', 'etag1', 'q'),
+      answerQuery({}, 'new', 'etag2', 'q'),
+    ]);
+    assertEqual(calls, 2);
+    assertEqual(a.answer, 'answer from old');
+    assertEqual(b.answer, 'answer from new');
+  });
+
+  // Summary
+  console.log('\n=== Results ===\n');
+  console.log(`  Passed: ${passed}`);
+  console.log(`  Failed: ${failed}`);
+  console.log('');
 
-process.exit(failed > 0 ? 1 : 0);
+  process.exit(failed > 0 ? 1 : 0);
+})();
@@ -20,14 +20,14 @@ export default {
           telegram: !!env.TELEGRAM_BOT_TOKEN,
         };
 
-        // Check vault context file exists and has content
+        // Check vault context file exists and has content - metadata only,
+        // the body is never downloaded
         try {
-          const contextFile = await env.VAULT.get('_vault_context.md');
+          const contextFile = await env.VAULT.head('_vault_context.md');
           if (contextFile) {
-            const content = await contextFile.text();
             checks.vault = {
-              ok: content.length > 1000,
-              sizeKB: Math.round(content.length / 1024),
+              ok: contextFile.size > 1000,
+              sizeKB: Math.round(contextFile.size / 1024),
             };
           } else {
             checks.vault = { ok: false, error: 'No context file' };
@@ -57,7 +57,7 @@ export default {
         }
 
         const update = await request.json();
-        ctx.waitUntil(handleTelegramUpdate(update, env));
+        ctx.waitUntil(handleTelegramUpdate(update, env, ctx));
         return jsonResponse({ ok: true });
       }
 
@@ -89,6 +89,57 @@ export default {
   },
 };
 
+// Recently seen Telegram update_ids (per isolate). Telegram redelivers an
+// update if the webhook is slow or fails, so drop repeats instead of
+// capturing or querying twice. update_id is already a unique integer, so it
+// is used directly as the key - no hashing needed.
+// Map keeps insertion order, so the oldest entry is always first.
+const seenUpdates = new Map();
+const DEDUP_WINDOW_MS = 10 * 60 * 1000;
+const DEDUP_MAX_ENTRIES = 10000;
+
+function isDuplicateUpdate(updateId, now = Date.now()) {
+  if (updateId === undefined) return false;
+
+  // Evict expired entries from the front - stops at the first live one
+  for (const [id, seenAt] of seenUpdates) {
+    if (now - seenAt <= DEDUP_WINDOW_MS) break;
+    seenUpdates.delete(id);
+  }
+
+  if (seenUpdates.has(updateId)) return true;
+
+  seenUpdates.set(updateId, now);
+  if (seenUpdates.size > DEDUP_MAX_ENTRIES) {
+    seenUpdates.delete(seenUpdates.keys().next().value);
+  }
+  return false;
+}
+
+// Short-lived cache for /recent and /stats, which otherwise list and read
+// the inbox on every call. Cleared on capture so new items show up at once.
+const inboxCache = new Map();
+const INBOX_CACHE_TTL_MS = 5000;
+
+async function cachedInboxLookup(key, load, now = Date.now()) {
+  const hit = inboxCache.get(key);
+  if (hit && hit.expires > now) return hit.value;
+
+  const value = await load();
+  inboxCache.set(key, { value, expires: now + INBOX_CACHE_TTL_MS });
+  return value;
+}
+
+/**
+ * Per-step trace logging, only when the DEBUG var is set. Takes a function
+ * so the message isn't even built when debug logging is off.
+ */
+function debugLog(env, message) {
+  if (env.DEBUG) {
+    console.log(message());
+  }
+}
+
 function jsonResponse(data, status = 200) {
   return new Response(JSON.stringify(data), {
     status,
@@ -96,15 +147,34 @@ function jsonResponse(data, status = 200) {
   });
 }
 
+// Exact-match commands -> handler, built once. /ask takes an argument
+// and is routed separately.
+const COMMANDS = new Map([
+  ['/help', (env, chatId) => handleHelpCommand(env, chatId)],
+  ['/start', (env, chatId) => handleHelpCommand(env, chatId)],
+  ['/recent', (env, chatId) => handleRecentCommand(env, chatId)],
+  ['/stats', (env, chatId) => handleStatsCommand(env, chatId)],
+  ['/health', (env, chatId) => sendTelegram(env, chatId, '✅ Bot is running')],
+  ['/digest', (env, chatId) => handleDigestCommand(env, chatId, 'morning')],
+  ['/digest morning', (env, chatId) => handleDigestCommand(env, chatId, 'morning')],
+  ['/digest evening', (env, chatId) => handleDigestCommand(env, chatId, 'evening')],
+]);
+
 /**
  * Handle incoming Telegram update
  */
-async function handleTelegramUpdate(update, env) {
-  console.log('Received update:', JSON.stringify(update).substring(0, 200));
-
+async function handleTelegramUpdate(update, env, ctx) {
+  // Log a summary rather than serializing the whole update just to truncate it
   const message = update.message;
+  debugLog(env, () => `Received update ${update.update_id}: ${message?.text ? `${message.text.length} chars` : 'no text'}`);
+
+  if (isDuplicateUpdate(update.update_id)) {
+    console.log(`Duplicate update ${update.update_id}, skipping`);
+    return;
+  }
+
   if (!message || !message.text) {
-    console.log('No message or text, skipping');
+    debugLog(env, () => 'No message or text, skipping');
     return;
   }
 
@@ -119,54 +189,56 @@ async function handleTelegramUpdate(update, env) {
   }
 
   // Command routing
+  const command = COMMANDS.get(text);
   if (text.startsWith('/ask ')) {
     const query = text.slice(5).trim();
-    await handleAskCommand(env, chatId, message.message_id, query);
-  } else if (text === '/help' || text === '/start') {
-    await handleHelpCommand(env, chatId);
-  } else if (text === '/recent') {
-    await handleRecentCommand(env, chatId);
-  } else if (text === '/stats') {
-    await handleStatsCommand(env, chatId);
-  } else if (text === '/health') {
-    await sendTelegram(env, chatId, '✅ Bot is running');
-  } else if (text === '/digest' || text === '/digest morning' || text === '/digest evening') {
-    const type = text.includes('evening') ? 'evening' : 'morning';
-    await handleDigestCommand(env, chatId, type);
+    await handleAskCommand(env, ctx, chatId, message.message_id, query);
+  } else if (command) {
+    await command(env, chatId);
   } else if (text.startsWith('/')) {
     // Unknown command
     await sendTelegram(env, chatId, `Unknown command. Try /help`);
   } else {
     // Default: capture to inbox
-    await handleCapture(env, chatId, message.message_id, text);
+    await handleCapture(env, ctx, chatId, message.message_id, text);
   }
 }
 
+// Last capture time handed out by this isolate. Captures in a burst can land
+// in the same millisecond, and the filename would then overwrite the
+// earlier capture in R2 - so each capture gets a distinct millisecond.
+let lastCaptureMs = 0;
+
+function nextCaptureTime(now = Date.now()) {
+  lastCaptureMs = Math.max(now, lastCaptureMs + 1);
+  return lastCaptureMs;
+}
+
 /**
  * Capture message to R2 inbox
  */
-async function handleCapture(env, chatId, messageId, text) {
-  console.log(`Capture: chatId=${chatId}, messageId=${messageId}, text=${text.substring(0, 50)}`);
+async function handleCapture(env, ctx, chatId, messageId, text) {
+  debugLog(env, () => `Capture: chatId=${chatId}, messageId=${messageId}, ${text.length} chars`);
   try {
-    const timestamp = new Date().toISOString().replace(/[:.]/g, '-');
+    // One clock read for both the filename and the note footer
+    const capturedAt = new Date(nextCaptureTime()).toISOString();
+    const timestamp = capturedAt.replace(/[:.]/g, '-');
     const filename = `telegram-${timestamp}.md`;
     const r2Key = `0-Inbox/${filename}`;
-    console.log(`Writing to R2: ${r2Key}`);
-
-    const content = `#telegram #capture
+    debugLog(env, () => `Writing to R2: ${r2Key}`);
 
-${text}
-
----
-*Captured via Telegram: ${new Date().toISOString()}*
-`;
+    const content = formatCapture(text, capturedAt);
 
     await env.VAULT.put(r2Key, content, {
       httpMetadata: { contentType: 'text/markdown' },
     });
+    inboxCache.clear();
 
-    // Trigger GitHub sync (fire-and-forget, don't block on failure)
-    notifyGitHub(filename, env).catch(e => console.log(`GitHub notify failed: ${e.message}`));
+    // Trigger GitHub sync in the background - the reaction doesn't wait on it,
+    // and waitUntil keeps the isolate alive until the dispatch completes
+    ctx.waitUntil(
+      notifyGitHub(filename, env).catch(e => console.log(`GitHub notify failed: ${e.message}`))
+    );
 
     // Confirm capture with reaction (thumbs up) and silent message
     await reactToMessage(env, chatId, messageId, '👍');
@@ -176,6 +248,13 @@ ${text}
   }
 }
 
+/**
+ * Format a capture note - one template, tags and footer around the text
+ */
+function formatCapture(text, capturedAt) {
+  return `#telegram #capture\n\n${text}\n\n---\n*Captured via Telegram: ${capturedAt}*\n`;
+}
+
 /**
  * Notify GitHub to sync capture from R2 (fire-and-forget)
  * Uses repository_dispatch to trigger sync-capture.yml workflow
@@ -203,18 +282,14 @@ async function notifyGitHub(filename, env) {
   );
 
   if (response.status === 204) {
-    console.log(`GitHub: triggered sync for ${filename}`);
+    debugLog(env, () => `GitHub: triggered sync for ${filename}`);
   } else {
     const text = await response.text();
     console.log(`GitHub: unexpected ${response.status} - ${text}`);
   }
 }
 
-/**
- * Handle /help command - list available commands
- */
-async function handleHelpCommand(env, chatId) {
-  const help = `*Second Brain Bot*
+const HELP_TEXT = `*Second Brain Bot*
 
 📝 *Capture* - Just send any text
 /ask <query> - Query your vault
@@ -227,7 +302,11 @@ async function handleHelpCommand(env, chatId) {
 
 _Tip: Send links, ideas, or notes - they're saved to your inbox for processing._`;
 
-  await sendTelegram(env, chatId, help);
+/**
+ * Handle /help command - list available commands
+ */
+async function handleHelpCommand(env, chatId) {
+  await sendTelegram(env, chatId, HELP_TEXT);
 }
 
 /**
@@ -276,41 +355,7 @@ async function handleDigestCommand(env, chatId, type) {
  */
 async function handleRecentCommand(env, chatId) {
   try {
-    // List objects in 0-Inbox/ prefix
-    const listed = await env.VAULT.list({ prefix: '0-Inbox/', limit: 10 });
-
-    if (!listed.objects || listed.objects.length === 0) {
-      await sendTelegram(env, chatId, '_📭 Inbox empty_');
-      return;
-    }
-
-    // Sort by uploaded time (most recent first) and take 5
-    const sorted = listed.objects
-      .sort((a, b) => new Date(b.uploaded) - new Date(a.uploaded))
-      .slice(0, 5);
-
-    // Build response
-    let response = '*📬 Recent Captures*\n\n';
-
-    for (const obj of sorted) {
-      // Get first line of content as preview
-      const file = await env.VAULT.get(obj.key);
-      if (file) {
-        const content = await file.text();
-        // Skip tags, get first meaningful line
-        const lines = content.split('\n').filter(l => l.trim() && !l.startsWith('#'));
-        const preview = lines[0]?.substring(0, 60) || '(empty)';
-        const truncated = preview.length >= 60 ? preview + '...' : preview;
-
-        // Parse timestamp from filename: telegram-2026-01-14T21-21-46-819Z.md
-        const match = obj.key.match(/telegram-(\d{4}-\d{2}-\d{2})T(\d{2})-(\d{2})/);
-        const dateStr = match ? `${match[1]} ${match[2]}:${match[3]}` : 'unknown';
-
-        response += `• _${dateStr}_\n${truncated}\n\n`;
-      }
-    }
-
-    response += `_${listed.objects.length} total in inbox_`;
+    const response = await cachedInboxLookup('recent', () => buildRecentMessage(env));
     await sendTelegram(env, chatId, response);
   } catch (error) {
     console.error('Recent error:', error);
@@ -318,35 +363,152 @@ async function handleRecentCommand(env, chatId) {
   }
 }
 
+// Bytes to read from the start of a capture for its /recent preview.
+// Covers the tag line plus the first line of text.
+const PREVIEW_BYTES = 512;
+
+// Prefix shared by every capture key: 0-Inbox/telegram-<ISO timestamp>.md
+const CAPTURE_PREFIX = '0-Inbox/telegram-';
+
+// Captures shown by /recent, and how far back (in days) to look for them
+// before falling back to a full listing
+const RECENT_COUNT = 5;
+const RECENT_WINDOWS_DAYS = [1, 7, 30, 365];
+
+/**
+ * Count every capture in R2. Captures are never deleted, so this is every
+ * capture ever saved, not what is still in the vault's inbox folder.
+ * Shared by /recent and /stats through the inbox cache.
+ */
+function cachedCaptureCount(env) {
+  return cachedInboxLookup('captureCount', async () => {
+    let count = 0;
+    let cursor;
+    do {
+      const listed = await env.VAULT.list({ prefix: CAPTURE_PREFIX, limit: 1000, cursor });
+      count += listed.objects?.length || 0;
+      cursor = listed.truncated ? listed.cursor : undefined;
+    } while (cursor);
+    return count;
+  });
+}
+
+/**
+ * List the newest captures, oldest first. Capture keys embed an ISO
+ * timestamp, so R2's key order is capture order. Listing starts after a
+ * recent timestamp key instead of paging through the whole history,
+ * widening the window until enough captures turn up.
+ */
+async function listRecentCaptures(env, now = Date.now()) {
+  const windows = [...RECENT_WINDOWS_DAYS.map(days => now - days * 86400000), null];
+  let tail = [];
+  for (const since of windows) {
+    const startAfter = since === null
+      ? undefined
+      : CAPTURE_PREFIX + new Date(since).toISOString().replace(/[:.]/g, '-');
+    tail = [];
+    let cursor;
+    do {
+      const listed = await env.VAULT.list({ prefix: CAPTURE_PREFIX, limit: 1000, startAfter, cursor });
+      tail = tail.concat(listed.objects || []).slice(-RECENT_COUNT);
+      cursor = listed.truncated ? listed.cursor : undefined;
+    } while (cursor);
+    if (tail.length >= RECENT_COUNT) break;
+  }
+  return tail;
+}
+
+/**
+ * Build the /recent message from the newest inbox captures
+ */
+async function buildRecentMessage(env) {
+  const [tail, total] = await Promise.all([
+    listRecentCaptures(env),
+    cachedCaptureCount(env),
+  ]);
+
+  if (tail.length === 0) {
+    return '_📭 Inbox empty_';
+  }
+
+  // Most recent first
+  const sorted = tail.reverse();
+
+  // Fetch all previews at once, then build the response in order
+  const entries = await Promise.all(sorted.map(obj => readCaptureEntry(env, obj.key)));
+
+  let response = '*📬 Recent Captures*\n\n';
+  for (const entry of entries) {
+    if (entry) response += entry;
+  }
+
+  response += `_${total} captures saved_`;
+  return response;
+}
+
+/**
+ * Read the head of one capture and format its /recent entry (or null if gone)
+ */
+async function readCaptureEntry(env, key) {
+  // Get first line of content as preview - only the head of the note is needed
+  const file = await env.VAULT.get(key, { range: { length: PREVIEW_BYTES } });
+  if (!file) return null;
+
+  const content = await file.text();
+  const preview = firstContentLine(content)?.substring(0, 60) || '(empty)';
+  const truncated = preview.length >= 60 ? preview + '...' : preview;
+
+  // Parse timestamp from filename: telegram-2026-01-14T21-21-46-819Z.md
+  const match = key.match(/telegram-(\d{4}-\d{2}-\d{2})T(\d{2})-(\d{2})/);
+  const dateStr = match ? `${match[1]} ${match[2]}:${match[3]}` : 'unknown';
+
+  return `• _${dateStr}_\n${truncated}\n\n`;
+}
+
+/**
+ * First non-blank line that isn't a tag/heading line, or undefined.
+ * Walks line by line so the rest of the note is never split.
+ */
+function firstContentLine(content) {
+  let start = 0;
+  while (start < content.length) {
+    let end = content.indexOf('\n', start);
+    if (end === -1) end = content.length;
+    const line = content.slice(start, end);
+    if (line.trim() && !line.startsWith('#')) return line;
+    start = end + 1;
+  }
+  return undefined;
+}
+
 /**
  * Handle /stats command - show vault statistics
  */
 async function handleStatsCommand(env, chatId) {
   try {
-    // Get vault context size
-    const contextFile = await env.VAULT.get('_vault_context.md');
-    let vaultInfo = 'Not synced';
-    let fileCount = 0;
+    const { vaultInfo, captureCount } = await cachedInboxLookup('stats', async () => {
+      // Get vault context size
+      const contextFile = await env.VAULT.get('_vault_context.md');
+      let vaultInfo = 'Not synced';
 
-    if (contextFile) {
-      const content = await contextFile.text();
-      const sizeKB = Math.round(content.length / 1024);
+      if (contextFile) {
+        const content = await contextFile.text();
+        const sizeKB = Math.round(contextFile.size / 1024);
 
-      // Count files from context (each file starts with "## File: ")
-      const matches = content.match(/^## File: /gm);
-      fileCount = matches ? matches.length : 0;
+        // Count files from context (each file starts with "## File: ")
+        const matches = content.match(/^## File: /gm);
+        const fileCount = matches ? matches.length : 0;
 
-      vaultInfo = `${sizeKB}KB · ${fileCount} files`;
-    }
+        vaultInfo = `${sizeKB}KB · ${fileCount} files`;
+      }
 
-    // Count inbox items
-    const inbox = await env.VAULT.list({ prefix: '0-Inbox/', limit: 100 });
-    const inboxCount = inbox.objects?.length || 0;
+      return { vaultInfo, captureCount: await cachedCaptureCount(env) };
+    });
 
     const stats = `*📊 Vault Stats*
 
 📁 Context: ${vaultInfo}
-📬 Inbox: ${inboxCount} captures
+📬 Captures: ${captureCount} saved
 🤖 Model: ${env.MODEL || 'gemini-2.5-flash-lite'}
 
 _Run sync-vault.sh to update context_`;
@@ -358,6 +520,9 @@ _Run sync-vault.sh to update context_`;
   }
 }
 
+// Concurrent R2 reads per export batch
+const EXPORT_BATCH_SIZE = 50;
+
 /**
  * Export all Telegram captures from R2
  * Returns JSON with all capture files and their content
@@ -371,18 +536,23 @@ async function exportCaptures(env) {
       return { captures: [], count: 0 };
     }
 
-    // Get content of each capture
+    // Get content of each capture - a batch of reads in flight at a time
+    // rather than one round-trip after another
     const captures = [];
-    for (const obj of listed.objects) {
-      const file = await env.VAULT.get(obj.key);
-      if (file) {
-        const content = await file.text();
-        captures.push({
+    for (let i = 0; i < listed.objects.length; i += EXPORT_BATCH_SIZE) {
+      const batch = listed.objects.slice(i, i + EXPORT_BATCH_SIZE);
+      const results = await Promise.all(batch.map(async obj => {
+        const file = await env.VAULT.get(obj.key);
+        if (!file) return null;
+        return {
           key: obj.key,
           filename: obj.key.split('/').pop(),
           uploaded: obj.uploaded,
-          content: content,
-        });
+          content: await file.text(),
+        };
+      }));
+      for (const capture of results) {
+        if (capture) captures.push(capture);
       }
     }
 
@@ -397,37 +567,63 @@ async function exportCaptures(env) {
   }
 }
 
+const ASK_TIMEOUT_MS = 25000; // 25s timeout (CF limit is 30s)
+
+// Telegram rejects messages over 4096 chars - leave room for the footer
+const MAX_ANSWER_CHARS = 3900;
+
+/**
+ * Cut an over-long answer at a paragraph (or line) break so Markdown
+ * entities are less likely to be split, never inside a surrogate pair
+ */
+function truncateAnswer(answer) {
+  if (answer.length <= MAX_ANSWER_CHARS) return answer;
+
+  let cut = answer.lastIndexOf('\n\n', MAX_ANSWER_CHARS);
+  if (cut < MAX_ANSWER_CHARS / 2) cut = answer.lastIndexOf('\n', MAX_ANSWER_CHARS);
+  if (cut < MAX_ANSWER_CHARS / 2) cut = MAX_ANSWER_CHARS;
+
+  const last = answer.charCodeAt(cut - 1);
+  if (last >= 0xd800 && last <= 0xdbff) cut--;
+
+  return `${answer.slice(0, cut).trimEnd()}\n\n_[Truncated]_`;
+}
+
 /**
  * Handle /ask query - load vault, query Gemini (with timeout protection)
  */
-async function handleAskCommand(env, chatId, messageId, query) {
-  const TIMEOUT_MS = 25000; // 25s timeout (CF limit is 30s)
+async function handleAskCommand(env, ctx, chatId, messageId, query) {
   const startTime = Date.now();
 
+  let timeoutId;
   const timeoutPromise = new Promise((_, reject) => {
-    setTimeout(() => reject(new Error('TIMEOUT')), TIMEOUT_MS);
+    timeoutId = setTimeout(() => reject(new Error('TIMEOUT')), ASK_TIMEOUT_MS);
   });
 
-  try {
-    // Send typing indicator
-    await sendChatAction(env, chatId, 'typing');
+  // Send typing indicator without waiting for it - the vault load starts now
+  ctx.waitUntil(
+    sendChatAction(env, chatId, 'typing').catch(e => console.log(`Typing action failed: ${e.message}`))
+  );
 
+  try {
     // Race against timeout
-    const { answer, vaultSizeKB } = await Promise.race([
+    const { answer, vaultSizeKB, cached } = await Promise.race([
       (async () => {
-        const { content, sizeKB } = await loadVaultFromR2(env);
+        const { content, sizeKB, etag } = await loadVaultFromR2(env);
         if (!content) {
           throw new Error('Vault empty - run sync first');
         }
-        const answer = await queryGemini(env, content, query);
-        return { answer, vaultSizeKB: sizeKB };
+
+        const { answer, cached } = await answerQuery(env, content, etag, query, startTime);
+        return { answer, vaultSizeKB: sizeKB, cached };
       })(),
       timeoutPromise,
     ]);
 
     // Add minimal footer with response time and vault size
     const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
-    const response = `${answer}\n\n_⚡ ${elapsed}s · ${vaultSizeKB}KB vault_`;
+    const source = cached ? ' · cached' : '';
+    const response = `${truncateAnswer(answer)}\n\n_⚡ ${elapsed}s · ${vaultSizeKB}KB vault${source}_`;
 
     await sendTelegram(env, chatId, response, { reply_to_message_id: messageId });
   } catch (error) {
@@ -439,98 +635,281 @@ async function handleAskCommand(env, chatId, messageId, query) {
     } else {
       await sendTelegram(env, chatId, `❌ ${error.message}\n\n_⚡ ${elapsed}s_`);
     }
+  } finally {
+    clearTimeout(timeoutId);
+  }
+}
+
+// Recent /ask answers (per isolate), keyed by normalized query. The cache
+// holds answers for one vault version only - it is emptied as soon as a
+// different context etag shows up, so stale answers are dropped rather than
+// left unreachable.
+const answerCache = new Map();
+const ANSWER_CACHE_TTL_MS = 10 * 60 * 1000;
+const ANSWER_CACHE_MAX_ENTRIES = 200;
+let answerCacheEtag = null;
+
+const TRAILING_PUNCTUATION = /[?.!]+$/;
+const WHITESPACE_RUN = /\s+/g;
+
+/**
+ * Normalize a query for cache lookups so trivial variations
+ * ("What is X?" vs "what is x") share one cached answer
+ */
+function normalizeQuery(query) {
+  return query
+    .toLowerCase()
+    .trim()
+    .replace(TRAILING_PUNCTUATION, '')
+    .replace(WHITESPACE_RUN, ' ');
+}
+
+// Gemini calls in progress, keyed by vault etag + normalized query, so
+// identical questions arriving before the first answer is cached (retries,
+// double sends) share one call instead of each paying for their own.
+//
+// A flight's fetch belongs to the request that started it: once that request
+// times out and its waitUntil ends, the runtime may cancel the fetch and the
+// shared promise never settles. So each flight records that request's
+// deadline, and a joiner only waits until then before making its own call.
+const inflightAnswers = new Map();
+const FLIGHT_ABANDONED = Symbol('flight abandoned');
+
+/**
+ * Wait for another request's Gemini call, but no longer than that request
+ * can keep it alive. Resolves to the answer or FLIGHT_ABANDONED.
+ */
+async function waitForFlight(flight) {
+  let timerId;
+  const abandoned = new Promise(resolve => {
+    timerId = setTimeout(() => resolve(FLIGHT_ABANDONED), Math.max(0, flight.deadline - Date.now()));
+  });
+  try {
+    return await Promise.race([flight.promise, abandoned]);
+  } finally {
+    clearTimeout(timerId);
+  }
+}
+
+/**
+ * Answer a query from the cache, an in-flight identical query, or Gemini.
+ * `now` is the request's start time, used for every cache decision so the
+ * lookup and the store agree on one clock reading.
+ * Returns { answer, cached }
+ */
+async function answerQuery(env, vaultContent, etag, query, now = Date.now()) {
+  const key = normalizeQuery(query);
+  const hit = getCachedAnswer(etag, key, now);
+  if (hit) {
+    return { answer: hit, cached: true };
+  }
+
+  const flightKey = `${etag}:${key}`;
+  const joined = inflightAnswers.get(flightKey);
+  if (joined) {
+    const answer = await waitForFlight(joined);
+    if (answer !== FLIGHT_ABANDONED) {
+      return { answer, cached: false };
+    }
+  }
+
+  const flight = { deadline: now + ASK_TIMEOUT_MS };
+  flight.promise = queryGemini(env, vaultContent, query)
+    .then(answer => {
+      cacheAnswer(etag, key, answer, now);
+      return answer;
+    })
+    .finally(() => {
+      // A joiner may have replaced an abandoned flight - leave that one be
+      if (inflightAnswers.get(flightKey) === flight) {
+        inflightAnswers.delete(flightKey);
+      }
+    });
+  inflightAnswers.set(flightKey, flight);
+
+  return { answer: await flight.promise, cached: false };
+}
+
+function resetAnswerCacheOnVaultChange(etag) {
+  if (etag !== answerCacheEtag) {
+    answerCache.clear();
+    answerCacheEtag = etag;
+  }
+}
+
+function getCachedAnswer(etag, key, now = Date.now()) {
+  resetAnswerCacheOnVaultChange(etag);
+  const hit = answerCache.get(key);
+  if (!hit) return null;
+  answerCache.delete(key);
+  if (now - hit.cachedAt > ANSWER_CACHE_TTL_MS) return null;
+
+  // Re-insert so the Map's order stays least-recently-used first
+  answerCache.set(key, hit);
+  return hit.answer;
+}
+
+/**
+ * Drop expired answers in one pass over the cache (deleting while iterating
+ * a Map is safe). Returns the number removed.
+ */
+function pruneExpiredAnswers(now = Date.now()) {
+  const before = answerCache.size;
+  for (const [key, entry] of answerCache) {
+    if (now - entry.cachedAt > ANSWER_CACHE_TTL_MS) {
+      answerCache.delete(key);
+    }
+  }
+  return before - answerCache.size;
+}
+
+function cacheAnswer(etag, key, answer, now = Date.now()) {
+  // Answer was computed against a vault version the cache has since moved
+  // past (a sync landed mid-query) - drop it. Only lookups switch versions.
+  if (etag !== answerCacheEtag) return;
+
+  answerCache.delete(key);
+  answerCache.set(key, { answer, cachedAt: now });
+
+  // At capacity: clear out expired answers first, then evict the LRU entry
+  if (answerCache.size > ANSWER_CACHE_MAX_ENTRIES && pruneExpiredAnswers(now) === 0) {
+    answerCache.delete(answerCache.keys().next().value);
   }
 }
 
+// Last loaded vault context, kept in isolate memory between queries
+let cachedVault = null;
+
 /**
  * Load pre-aggregated vault context from R2 (single file, fast)
- * Returns { content, sizeKB } or { content: null, sizeKB: 0 }
+ * Revalidated with a conditional GET on every call: a sync is picked up
+ * immediately, but an unchanged vault is not downloaded again.
+ * Returns { content, sizeKB, etag } or { content: null, sizeKB: 0 }
  */
 async function loadVaultFromR2(env) {
-  console.log('Loading vault context from R2...');
+  debugLog(env, () => 'Loading vault context from R2...');
 
   try {
-    // Load single pre-aggregated context file
-    const contextFile = await env.VAULT.get('_vault_context.md');
+    // Load single pre-aggregated context file, unless it matches what we hold
+    const options = cachedVault ? { onlyIf: { etagDoesNotMatch: cachedVault.etag } } : {};
+    const contextFile = await env.VAULT.get('_vault_context.md', options);
 
     if (!contextFile) {
+      cachedVault = null;
       console.error('No _vault_context.md found - run sync-vault.sh first');
       return { content: null, sizeKB: 0 };
     }
 
+    // Precondition failed - no body returned, the cached copy is current
+    if (!('body' in contextFile)) {
+      debugLog(env, () => `Vault context unchanged (${cachedVault.sizeKB}KB)`);
+      return cachedVault;
+    }
+
     const content = await contextFile.text();
-    const sizeKB = Math.round(content.length / 1024);
-    console.log(`Loaded vault context (${sizeKB}KB)`);
+    const sizeKB = Math.round(contextFile.size / 1024);
+    debugLog(env, () => `Loaded vault context (${sizeKB}KB)`);
 
-    return { content, sizeKB };
+    cachedVault = { content, sizeKB, etag: contextFile.etag };
+    return cachedVault;
   } catch (error) {
     console.error('Failed to load vault context:', error);
     return { content: null, sizeKB: 0 };
   }
 }
 
+// Instruction-override phrases, combined into one alternation so each query
+// is scanned once instead of once per phrase
+const INJECTION_PATTERN = new RegExp(
+  [
+    '(?:ignore|disregard|forget) (?:all )?(?:previous |above |prior )?instructions',
+    'you are now',
+    'new instructions:',
+    'system prompt:',
+  ].join('|'),
+  'gi'
+);
+
 /**
  * Sanitize user query to prevent basic prompt injection
  */
 function sanitizeQuery(query) {
   // Remove potential instruction overrides
-  const dangerous = [
-    /ignore (all )?(previous |above |prior )?instructions/gi,
-    /disregard (all )?(previous |above |prior )?instructions/gi,
-    /forget (all )?(previous |above |prior )?instructions/gi,
-    /you are now/gi,
-    /new instructions:/gi,
-    /system prompt:/gi,
-  ];
-
-  let sanitized = query;
-  for (const pattern of dangerous) {
-    sanitized = sanitized.replace(pattern, '[removed]');
-  }
+  const sanitized = query.replace(INJECTION_PATTERN, '[removed]');
 
   // Limit length to prevent context stuffing attacks
   return sanitized.slice(0, 1000);
 }
 
-/**
- * Query Gemini with vault context
- */
-async function queryGemini(env, vaultContent, query) {
-  const model = env.MODEL || 'gemini-2.5-flash-lite';
-  const apiKey = env.GEMINI_API_KEY;
+// Static prompt pieces and request config, built once per isolate.
+// The preamble + vault form a stable prefix for Gemini's implicit caching.
+const PROMPT_PREAMBLE = `You are a helpful assistant with access to a personal knowledge vault.
 
-  if (!apiKey) {
-    throw new Error('GEMINI_API_KEY not configured');
-  }
+Here is the vault content:
 
-  const sanitizedQuery = sanitizeQuery(query);
+`;
 
-  const prompt = `You are a helpful assistant with access to a personal knowledge vault.
+const PROMPT_INSTRUCTIONS = `Be concise and specific. If you can't find relevant information in the vault, say so.
+Cite which files you found the information in when relevant.`;
 
-Here is the vault content:
+const GENERATION_CONFIG_JSON = JSON.stringify({
+  maxOutputTokens: 1024,
+  temperature: 0.7,
+});
+
+// JSON-encoded preamble + vault, without the closing quote, for the last
+// vault seen. The vault is the bulk of every request body, so it is escaped
+// once per vault version instead of once per query. JSON string escaping is
+// per character, so the question part's encoding can be appended directly.
+let encodedPrefix = { vaultContent: null, json: null };
+
+function encodedPromptPrefix(vaultContent) {
+  if (encodedPrefix.vaultContent !== vaultContent) {
+    encodedPrefix = {
+      vaultContent,
+      json: JSON.stringify(PROMPT_PREAMBLE + vaultContent).slice(0, -1),
+    };
+  }
+  return encodedPrefix.json;
+}
 
-${vaultContent}
+/**
+ * Build the generateContent request body. Equal to JSON.stringify of the
+ * same request, but splices in the cached vault encoding.
+ */
+function buildGeminiBody(vaultContent, sanitizedQuery) {
+  // The prompt is the (pre-encoded) preamble + vault, then the question part
+  const questionPart = `
 
 ---
 
 Based on the vault content above, answer this question:
 ${sanitizedQuery}
 
-Be concise and specific. If you can't find relevant information in the vault, say so.
-Cite which files you found the information in when relevant.`;
+${PROMPT_INSTRUCTIONS}`;
+  const promptJson = encodedPromptPrefix(vaultContent) + JSON.stringify(questionPart).slice(1);
+
+  return `{"contents":[{"parts":[{"text":${promptJson}}]}],"generationConfig":${GENERATION_CONFIG_JSON}}`;
+}
+
+/**
+ * Query Gemini with vault context
+ */
+async function queryGemini(env, vaultContent, query) {
+  const model = env.MODEL || 'gemini-2.5-flash-lite';
+  const apiKey = env.GEMINI_API_KEY;
+
+  if (!apiKey) {
+    throw new Error('GEMINI_API_KEY not configured');
+  }
 
   const response = await fetch(
-    `https://generativelanguage.googleapis.com/v1beta/models/${model}:generateContent?key=${apiKey}`,
+    `https://generativelanguage.googleapis.com/v1beta/models/${model}:generateContent`,
     {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        contents: [{ parts: [{ text: prompt }] }],
-        generationConfig: {
-          maxOutputTokens: 1024,
-          temperature: 0.7,
-        },
-      }),
+      // Key in a header, not the URL, so it can't end up in logged URLs
+      headers: { 'Content-Type': 'application/json', 'x-goog-api-key': apiKey },
+      body: buildGeminiBody(vaultContent, sanitizeQuery(query)),
     }
   );
 
@@ -541,8 +920,12 @@ Cite which files you found the information in when relevant.`;
 
   const data = await response.json();
 
-  // Extract response text
-  const text = data.candidates?.[0]?.content?.parts?.[0]?.text;
+  // Extract response text - usually one part, but longer answers can be
+  // split across several, so join them (skipping any thought summaries)
+  const parts = data.candidates?.[0]?.content?.parts || [];
+  const text = parts.length === 1
+    ? parts[0].text
+    : parts.filter(p => p.text && !p.thought).map(p => p.text).join('');
   if (!text) {
     throw new Error('No response from Gemini');
   }
@@ -552,18 +935,43 @@ Cite which files you found the information in when relevant.`;
 
 
 // Telegram API helpers
+
+// Success bodies are never used - discard them unread. Only a failed call's
+// body is read, for the error log.
+async function checkTelegramResponse(response, method) {
+  if (response.ok) {
+    await response.body?.cancel();
+  } else {
+    console.error(`Telegram ${method} failed:`, await response.text());
+  }
+}
+
 async function sendTelegram(env, chatId, text, options = {}) {
   const url = `https://api.telegram.org/bot${env.TELEGRAM_BOT_TOKEN}/sendMessage`;
-  await fetch(url, {
+  const send = (extra) => fetch(url, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({
       chat_id: chatId,
       text: text,
-      parse_mode: 'Markdown',
+      ...extra,
       ...options,
     }),
   });
+
+  const response = await send({ parse_mode: 'Markdown' });
+  if (response.status === 400) {
+    const error = await response.text();
+    if (!error.includes("can't parse entities")) {
+      console.error('Telegram sendMessage failed:', error);
+      return;
+    }
+    // Unbalanced Markdown (model answers can contain stray * or _) - the
+    // message would be lost entirely, so send it again as plain text
+    await checkTelegramResponse(await send({}), 'sendMessage');
+    return;
+  }
+  await checkTelegramResponse(response, 'sendMessage');
 }
 
 async function reactToMessage(env, chatId, messageId, emoji) {
@@ -585,14 +993,12 @@ async function reactToMessage(env, chatId, messageId, emoji) {
     }),
   });
 
-  if (!response.ok) {
-    console.error('Reaction failed:', await response.text());
-  }
+  await checkTelegramResponse(response, 'setMessageReaction');
 }
 
 async function sendChatAction(env, chatId, action) {
   const url = `https://api.telegram.org/bot${env.TELEGRAM_BOT_TOKEN}/sendChatAction`;
-  await fetch(url, {
+  const response = await fetch(url, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({
@@ -600,4 +1006,5 @@ async function sendChatAction(env, chatId, action) {
       action: action,
     }),
   });
+  await checkTelegramResponse(response, 'sendChatAction');
 }